@@ -8,16 +8,108 @@ Handles authentication, privacy, & offline sync
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hashlib
+import queue
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Events whose url + title match any of these are not uploaded
+DEFAULT_EXCLUDE_PATTERNS = [
+    r"localhost",
+    r"127\.0\.0\.1",
+    r"gmail\.com/mail",  # Private email
+    r"facebook\.com",
+    r"reddit\.com",
+]
+
+# Time windows _fetch_local_pages() reads a bucket in: the narrowest window,
+# the most a window widens after a sparse one, and the pages of one window
+# held in memory before it is narrowed and read again
+MIN_PAGE_WINDOW = timedelta(milliseconds=1)
+PAGE_WINDOW_GROWTH = 4
+MAX_WINDOW_PAGES = 8
+
+# Patterns redacted in titles (case-insensitive)
+DEFAULT_REDACT_PATTERNS = {
+    "password": r"password[:\s]*[^\s]+",
+    "token": r"token[:\s]*[^\s]+",
+    "apikey": r"(api[_-]?key|apikey)[:\s]*[^\s]+",
+    "ssn": r"\d{3}-\d{2}-\d{4}",
+}
+
+
+class PrivacyFilter:
+    """
+    Precompiled privacy filter. Exclusion is one combined regex. Redaction
+    scans each title once with a combined regex and only runs the individual
+    substitutions, in order, on titles that contain something to redact;
+    applying them in order keeps a secret that follows another keyword
+    ("api-key password: x") redacted. Results are memoized per title, since
+    the same window titles come up over and over.
+    """
+
+    def __init__(self,
+                 exclude_patterns: List[str] = None,
+                 redact_patterns: Dict[str, str] = None,
+                 cache_size: int = 4096):
+        exclude_patterns = DEFAULT_EXCLUDE_PATTERNS if exclude_patterns is None else exclude_patterns
+        redact_patterns = DEFAULT_REDACT_PATTERNS if redact_patterns is None else redact_patterns
+
+        self._exclude = re.compile("|".join(f"(?:{p})" for p in exclude_patterns)) if exclude_patterns else None
+        self._redact_any = re.compile(
+            "|".join(f"(?:{p})" for p in redact_patterns.values()), re.IGNORECASE
+        ) if redact_patterns else None
+        self._redact_each = [re.compile(p, re.IGNORECASE) for p in redact_patterns.values()]
+
+        self.is_excluded = lru_cache(maxsize=cache_size)(self._is_excluded)
+        self.redact = lru_cache(maxsize=cache_size)(self._redact_title)
+
+    @classmethod
+    def from_file(cls, path: str) -> "PrivacyFilter":
+        """Load {"exclude": [...], "redact": {name: pattern}} from a JSON file"""
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config.get("exclude"), config.get("redact"))
+
+    def _is_excluded(self, text: str) -> bool:
+        return bool(self._exclude and self._exclude.search(text))
+
+    def _redact_title(self, title: str) -> str:
+        if not self._redact_any or not self._redact_any.search(title):
+            return title
+        for pattern in self._redact_each:
+            title = pattern.sub("[REDACTED]", title)
+        return title
+
+    def filter(self, events: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield redacted copies of the events that are not excluded"""
+        for event in events:
+            data = event.get("data") or {}
+            title = data.get("title", "")
+
+            # Skip excluded patterns
+            if self.is_excluded(data.get("url", "") + title):
+                continue
+
+            # Redact sensitive data in title
+            if title:
+                redacted = self.redact(title)
+                if redacted != title:
+                    event = dict(event, data=dict(data, title=redacted))
+            yield event
+
 class EnterpriseSyncService:
     """Main sync orchestrator"""
     
@@ -26,7 +118,17 @@ class EnterpriseSyncService:
                  employee_id: str,          # Employee identifier
                  api_key: str,              # API authentication key
                  device_id: str = None,     # Machine identifier
-                 sync_interval: int = 300):  # Sync every 5 mins
+                 sync_interval: int = 300,  # Sync every 5 mins
+                 pool_size: int = 4,        # Keep-alive connections per server
+                 max_retries: int = 3,      # Retries on connection errors / 502-504
+                 timeout: float = 30,       # Read timeout in seconds
+                 state_file: str = None,    # Where per-bucket sync progress is kept
+                 page_size: int = 500,      # Events per request to the local server
+                 page_window: float = 3600, # Seconds of events in the first request per bucket
+                 chunk_size: int = 1000,    # Max events per upload
+                 privacy_filter: PrivacyFilter = None,
+                 fetch_workers: int = 3,    # Buckets fetched from the local server at once
+                 upload_queue_size: int = 2):  # Payloads waiting for upload
         
         self.server_url = server_url
         self.employee_id = employee_id
@@ -35,6 +137,30 @@ class EnterpriseSyncService:
         self.sync_interval = sync_interval
         self.local_server = "http://localhost:5600"
         self.last_sync = None
+        self.timeout = (5, timeout)
+        self.session = self._create_session(pool_size, max_retries)
+        self.state_file = Path(state_file or Path.home() / ".aw_enterprise_sync_state.json")
+        self.page_size = page_size
+        self.page_window = timedelta(seconds=page_window)
+        self.chunk_size = chunk_size
+        self.fetch_workers = fetch_workers
+        self.upload_queue_size = upload_queue_size
+        self.watermarks = self._load_watermarks()
+        self.privacy_filter = privacy_filter or PrivacyFilter()
+        
+    def _create_session(self, pool_size: int, max_retries: int) -> requests.Session:
+        """Pooled keep-alive session shared by local reads and central uploads"""
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None  # retry uploads too; the payload is checksummed
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
         
     def _get_device_id(self) -> str:
         """Generate unique device identifier"""
@@ -57,93 +183,240 @@ class EnterpriseSyncService:
                 time.sleep(10)  # Retry sooner on error
     
     def sync_events(self):
-        """Fetch events from local server & upload to central"""
+        """
+        Upload events recorded since the last sync, in bounded chunks.
+
+        Buckets are fetched from the local server concurrently, a page at a
+        time. Payloads are handed to an upload thread through a bounded queue,
+        so filtering and compressing the next chunk overlaps with uploading
+        the previous one. Each fetch thread holds at most one page and one
+        chunk, and at most upload_queue_size payloads wait in memory, however
+        long the machine was offline.
+        """
+        uploads = queue.Queue(maxsize=self.upload_queue_size)
+        result = {"synced": 0, "failed": False}
+        uploader = threading.Thread(target=self._upload_worker, args=(uploads, result), daemon=True)
+        uploader.start()
+
         try:
-            # 1. Fetch events from local ActivityWatch server
-            events = self._fetch_local_events()
-            
-            if not events:
-                logger.debug("No new events to sync")
-                return
-            
-            # 2. Apply privacy filters
-            events = self._apply_privacy_filters(events)
-            
-            # 3. Create sync payload
-            payload = self._create_payload(events)
-            
-            # 4. Upload to central server
-            response = self._upload_to_server(payload)
-            
-            if response.status_code == 200:
-                self.last_sync = datetime.now()
-                logger.info(f"Synced {len(events)} events successfully")
-            else:
-                logger.error(f"Upload failed: {response.status_code}")
-                
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as pool:
+                futures = [pool.submit(self._sync_bucket, b, uploads, result) for b in self._bucket_ids()]
+                for future in as_completed(futures):
+                    future.result()
+
+        except requests.exceptions.ConnectionError as e:
+            logger.warning(f"Sync interrupted, will resume from the last watermark: {e}")
         except Exception as e:
             logger.error(f"Sync failed: {e}")
-    
-    def _fetch_local_events(self, limit: int = 500) -> List[Dict]:
-        """Get events from local aw-server"""
-        bucket_ids = [
+        finally:
+            uploads.put(None)
+            uploader.join()
+
+        if result["synced"]:
+            self.last_sync = datetime.now()
+            logger.info(f"Synced {result['synced']} events successfully")
+        elif not result["failed"]:
+            logger.debug("No new events to sync")
+
+    def _sync_bucket(self, bucket_id: str, uploads: queue.Queue, result: Dict):
+        """Queue a bucket's new events for upload in chunks of chunk_size, oldest first"""
+        chunk = []
+        # 1. Fetch events newer than the bucket's watermark, one page at a time
+        for page in self._fetch_local_pages(bucket_id):
+            chunk.extend(page)
+            while len(chunk) >= self.chunk_size:
+                if result["failed"]:
+                    return  # Everything after a failed chunk is retried next cycle
+                self._queue_chunk(bucket_id, chunk[:self.chunk_size], uploads)
+                del chunk[:self.chunk_size]
+        if chunk and not result["failed"]:
+            self._queue_chunk(bucket_id, chunk, uploads)
+
+    def _queue_chunk(self, bucket_id: str, chunk: List[Dict], uploads: queue.Queue):
+        # 2. Apply privacy filters (redacted events are copies; the watermark uses the raw ones)
+        filtered = list(self._apply_privacy_filters(chunk))
+
+        # 3. Create sync payload, then queue it for upload (blocks while the queue is full)
+        payload = self._create_payload(filtered) if filtered else None
+        uploads.put((bucket_id, chunk[-1], payload, len(filtered)))
+
+    def _upload_worker(self, uploads: queue.Queue, result: Dict):
+        """Upload queued payloads in order, moving each bucket's watermark as its chunks land"""
+        while True:
+            item = uploads.get()
+            if item is None:
+                return
+            if result["failed"]:
+                continue  # Drain; everything after a failed chunk is retried next cycle
+
+            bucket_id, last_event, payload, count = item
+            try:
+                # 4. Upload to central server
+                if payload is not None:
+                    response = self._upload_to_server(payload)
+                    if response.status_code != 200:
+                        logger.error(f"Upload failed: {response.status_code}")
+                        result["failed"] = True
+                        continue
+
+                # 5. Only now move the watermark past this chunk
+                self._advance_watermark(bucket_id, last_event)
+                result["synced"] += count
+            except Exception as e:
+                logger.error(f"Upload failed: {e}")
+                result["failed"] = True
+
+    def _bucket_ids(self) -> List[str]:
+        return [
             f"aw-watcher-window_{self.device_id}",
             f"aw-watcher-afk_{self.device_id}",
             f"aw-watcher-web_{self.device_id}"
         ]
-        
-        all_events = []
-        for bucket_id in bucket_ids:
-            try:
-                url = f"{self.local_server}/api/0/buckets/{bucket_id}/events"
-                response = requests.get(url, params={"limit": limit})
-                if response.status_code == 200:
-                    all_events.extend(response.json())
-            except requests.exceptions.ConnectionError:
-                logger.warning("Could not connect to local server")
-                return []
-        
-        return all_events
-    
-    def _apply_privacy_filters(self, events: List[Dict]) -> List[Dict]:
-        """Remove/redact sensitive data before upload"""
-        import re
-        
-        # List of domains/apps to exclude
-        EXCLUDE_PATTERNS = [
-            r"localhost",
-            r"127\.0\.0\.1",
-            r"gmail\.com/mail",  # Private email
-            r"facebook\.com",
-            r"reddit\.com",
-        ]
-        
-        # Patterns to redact in titles
-        REDACT_PATTERNS = {
-            "password": r"password[:\s]*[^\s]+",
-            "token": r"token[:\s]*[^\s]+",
-            "apikey": r"(api[_-]?key|apikey)[:\s]*[^\s]+",
-            "ssn": r"\d{3}-\d{2}-\d{4}",
-        }
-        
-        filtered_events = []
-        for event in events:
-            data = event.get("data", {})
-            url = data.get("url", "")
-            title = data.get("title", "")
-            
-            # Skip excluded patterns
-            if any(re.search(pattern, url + title) for pattern in EXCLUDE_PATTERNS):
+
+    def _fetch_local_pages(self, bucket_id: str) -> Iterator[List[Dict]]:
+        """
+        Yield a bucket's events from the local aw-server that are newer than
+        its watermark, oldest first, a page at a time.
+
+        aw-server returns the newest `limit` events of a start/end range, so
+        the bucket is read forward in time windows, each sized from the last
+        one's event density to hold about a page. A window holding more is
+        read backwards a page at a time and its pages are replayed oldest
+        first; only a window of more than MAX_WINDOW_PAGES pages is narrowed
+        and read again. The walk stops at the newest event at the start of
+        the cycle; events recorded meanwhile wait for the next cycle.
+        """
+        url = f"{self.local_server}/api/0/buckets/{bucket_id}/events"
+        response = self.session.get(url, params={"limit": 1}, timeout=self.timeout)
+        if response.status_code == 404:
+            return  # Watcher not installed on this machine
+        response.raise_for_status()
+        newest = response.json()
+        if not newest:
+            return
+        stop = self._parse_timestamp(newest[0]["timestamp"])
+
+        watermark = self.watermarks.get(bucket_id)
+        if watermark:
+            start = self._parse_timestamp(watermark["timestamp"])
+        else:
+            start = self._oldest_bound(url, stop)
+
+        mark = watermark
+        window = self.page_window
+        while True:
+            end = min(start + window, stop)
+            pages, reached = self._read_window(url, bucket_id, start, end)
+            if reached is not None:
+                # Too many events for one window: narrow it to about a page at
+                # the density seen and read it again
+                window = max(MIN_PAGE_WINDOW, (end - reached) / len(pages))
                 continue
-            
-            # Redact sensitive data in title
-            for pattern in REDACT_PATTERNS.values():
-                title = re.sub(pattern, "[REDACTED]", title, flags=re.IGNORECASE)
-            
-            event["data"]["title"] = title
-            filtered_events.append(event)
-        
-        return filtered_events
+            count = sum(len(page) for page in pages)
+            window = max(MIN_PAGE_WINDOW, (end - start) * min(PAGE_WINDOW_GROWTH, self.page_size / max(count, 1)))
+
+            for page in reversed(pages):
+                # Pages overlap on their boundary timestamp; `mark` skips what was already yielded
+                events = [e for e in page if self._is_new(e, mark)]
+                if not events:
+                    continue
+                events.sort(key=lambda e: (self._parse_timestamp(e["timestamp"]), e.get("id") or 0))
+                for event in events:
+                    # Tag events so the server files them in the right bucket
+                    event["bucket_id"] = bucket_id
+                last = events[-1]
+                mark = {"timestamp": last["timestamp"], "id": last.get("id") or 0, "duration": last.get("duration") or 0}
+                yield events
+            if end >= stop:
+                return
+            start = end
+
+    def _read_window(self, url: str, bucket_id: str, start: datetime, end: datetime) -> Tuple[List[List[Dict]], Optional[datetime]]:
+        """
+        A window's events as pages, newest first, each page reaching back from
+        the oldest event of the one before, and None. If the window holds more
+        than MAX_WINDOW_PAGES pages, the pages read so far and the oldest
+        timestamp they reach instead.
+        """
+        pages = []
+        page_end = end
+        while True:
+            params = {"start": start.isoformat(), "end": page_end.isoformat(), "limit": self.page_size}
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            page = response.json()
+            pages.append(page)
+            if len(page) < self.page_size:
+                return pages, None
+            timestamps = [self._parse_timestamp(e["timestamp"]) for e in page]
+            # Events that started before the window but reach into it don't count
+            oldest = min((t for t in timestamps if t >= start), default=start)
+            if oldest <= start or oldest == page_end:
+                logger.warning(f"More than {self.page_size} events in {bucket_id} at {oldest}; "
+                               "syncing the newest of them")
+                return pages, None
+            if len(pages) == MAX_WINDOW_PAGES:
+                return pages, oldest
+            page_end = oldest
+
+    def _oldest_bound(self, url: str, stop: datetime) -> datetime:
+        """A time no later than a bucket's oldest event, found with a few one-event requests"""
+        span = self.page_window
+        while True:
+            bound = stop - span
+            response = self.session.get(url, params={"end": bound.isoformat(), "limit": 1}, timeout=self.timeout)
+            response.raise_for_status()
+            if not response.json():
+                return bound
+            span *= 2
+
+    def _is_new(self, event: Dict, watermark: Dict) -> bool:
+        """
+        True if the event comes after the watermark. The watermark event itself
+        is sent again if its duration has grown (it was still being extended
+        by heartbeats at the last sync).
+        """
+        if not watermark:
+            return True
+        timestamp = self._parse_timestamp(event["timestamp"])
+        mark = self._parse_timestamp(watermark["timestamp"])
+        if timestamp != mark:
+            return timestamp > mark
+        event_id = event.get("id") or 0
+        if event_id != watermark["id"]:
+            return event_id > watermark["id"]
+        return (event.get("duration") or 0) > watermark["duration"]
+
+    @staticmethod
+    def _parse_timestamp(value: str) -> datetime:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+    def _load_watermarks(self) -> Dict:
+        """Per-bucket {timestamp, id, duration} of the newest uploaded event"""
+        try:
+            with open(self.state_file) as f:
+                return json.load(f).get("watermarks", {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read sync state {self.state_file}, starting over: {e}")
+            return {}
+
+    def _advance_watermark(self, bucket_id: str, event: Dict):
+        self.watermarks[bucket_id] = {
+            "timestamp": event["timestamp"],
+            "id": event.get("id") or 0,
+            "duration": event.get("duration") or 0
+        }
+        # Write-then-rename so a crash never leaves a half-written state file
+        tmp_file = self.state_file.with_name(self.state_file.name + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump({"watermarks": self.watermarks}, f)
+        os.replace(tmp_file, self.state_file)
+
+    def _apply_privacy_filters(self, events: Iterable[Dict]) -> Iterator[Dict]:
+        """Remove/redact sensitive data before upload (lazily, one event at a time)"""
+        return self.privacy_filter.filter(events)
     
     def _create_payload(self, events: List[Dict]) -> Dict:
         """Package events for upload"""
@@ -185,11 +458,11 @@ class EnterpriseSyncService:
             "X-Event-Count": str(payload["metadata"]["event_count"])
         }
         
-        response = requests.post(
+        response = self.session.post(
             url,
             data=payload["data"],
             headers=headers,
-            timeout=30
+            timeout=self.timeout
         )
         
         return response
@@ -201,8 +474,20 @@ if __name__ == "__main__":
         "server_url": os.getenv("AW_SERVER_URL", "https://activitywatch.company.com"),
         "employee_id": os.getenv("EMPLOYEE_ID"),
         "api_key": os.getenv("AW_API_KEY"),
-        "sync_interval": int(os.getenv("SYNC_INTERVAL", "300"))
+        "sync_interval": int(os.getenv("SYNC_INTERVAL", "300")),
+        "pool_size": int(os.getenv("SYNC_POOL_SIZE", "4")),
+        "max_retries": int(os.getenv("SYNC_MAX_RETRIES", "3")),
+        "timeout": float(os.getenv("SYNC_TIMEOUT", "30")),
+        "state_file": os.getenv("SYNC_STATE_FILE"),
+        "page_size": int(os.getenv("SYNC_PAGE_SIZE", "500")),
+        "chunk_size": int(os.getenv("SYNC_CHUNK_SIZE", "1000")),
+        "fetch_workers": int(os.getenv("SYNC_FETCH_WORKERS", "3"))
     }
     
+    # Optional JSON file overriding the exclude/redact patterns
+    privacy_config = os.getenv("SYNC_PRIVACY_CONFIG")
+    if privacy_config:
+        config["privacy_filter"] = PrivacyFilter.from_file(privacy_config)
+    
     sync = EnterpriseSyncService(**config)
     sync.sync_loop()
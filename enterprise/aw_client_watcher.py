@@ -2,15 +2,37 @@
 """
 ActivityWatch Client Watcher
 Collects window and AFK data and sends to MySQL server
+
+The session, polling and scheduling helpers are shared with the employee
+watcher, in employee-deploy/aw_watcher_common.py.
 """
 
+import os
+import sys
 import time
+import queue
 import socket
+import ctypes
 import requests
 from datetime import datetime, timezone
+from functools import lru_cache
 import threading
 import logging
 
+try:
+    from ctypes import wintypes
+except (ImportError, ValueError):
+    wintypes = None
+
+# Helpers shared with the employee watcher, kept in the self-contained deploy folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "employee-deploy"))
+from aw_watcher_common import make_session, would_merge, AdaptivePoller, Scheduler, watch_foreground_changes
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -20,29 +42,224 @@ DEVICE_ID = socket.gethostname()
 EMPLOYEE_ID = "default"  # Changed to match default for aw-webui compatibility
 
 # Collection settings
-WINDOW_POLL_INTERVAL = 5  # seconds
+WINDOW_POLL_INTERVAL = 5  # seconds, while the window keeps changing
+WINDOW_MAX_POLL_INTERVAL = 30  # seconds, after the window has stayed the same for a while
+AFK_POLL_INTERVAL = 5  # seconds, right after the AFK status changed
+AFK_MAX_POLL_INTERVAL = 30  # seconds, while the AFK status stays the same
 AFK_TIMEOUT = 180  # 3 minutes of no input = AFK
+FLUSH_INTERVAL = 60  # seconds between updates while nothing changes
+EVENT_DRIVEN = True  # wake up on foreground window changes where the OS can tell us
+WAKE_DEBOUNCE = 1.0  # seconds to wait after an OS notification, so bursts become one poll
+UPLOAD_QUEUE_SIZE = 10000  # heartbeats waiting for the uploader before new ones are dropped
+
+# HTTP settings - one pooled keep-alive session shared by all watchers
+HTTP_POOL_SIZE = 4  # connections kept open to the server
+HTTP_RETRIES = 3  # retries on connection errors and 502/503/504
+HTTP_TIMEOUT = (5, 10)  # (connect, read) seconds
+
+http = make_session(HTTP_POOL_SIZE, HTTP_RETRIES)
+
+
+class HeartbeatUploader:
+    """Posts queued heartbeats to the server, in order, from one background thread"""
+
+    def __init__(self, maxsize=UPLOAD_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Send what is still queued, then stop"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def put(self, bucket_id, event, pulsetime, on_done=None):
+        """
+        Queue a heartbeat. on_done(delivered) is called once it was posted
+        (from the upload thread), or right away if it had to be dropped.
+        """
+        try:
+            self.queue.put_nowait((bucket_id, event, pulsetime, on_done))
+        except queue.Full:
+            logger.warning("Upload queue full - dropping heartbeat")
+            if on_done:
+                on_done(False)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            bucket_id, event, pulsetime, on_done = item
+            delivered = self.post(bucket_id, event, pulsetime)
+            if on_done:
+                on_done(delivered)
+
+    def post(self, bucket_id, event, pulsetime):
+        try:
+            response = http.post(
+                f"{SERVER_URL}/api/0/buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}",
+                json=event,
+                timeout=HTTP_TIMEOUT
+            )
+            if response.status_code != 200:
+                logger.warning(f"Heartbeat failed: {response.status_code}")
+            return response.status_code == 200
+
+        except requests.exceptions.ConnectionError:
+            logger.warning("Server not available, will retry...")
+        except Exception as e:
+            logger.error(f"Error sending heartbeat: {e}")
+        return False
+
+
+class HeartbeatMerger:
+    """
+    Merges unchanged heartbeats locally before they reach the server.
+
+    The first heartbeat of a run is sent right away. Later heartbeats with the
+    same data only move the run's end forward, and the end is sent at most once
+    per flush interval as a heartbeat whose pulsetime reaches back to the start
+    of the run. On a state change the pending end is sent before the new data,
+    so the server computes the same durations as it would from every heartbeat.
+
+    The uploader reports back whether each heartbeat was delivered. An end
+    stays pending until the server has it, and if a run's opening heartbeat
+    was lost it is sent again before the run's end, so the end extends the
+    run instead of opening a new zero-length event.
+    """
+
+    def __init__(self, bucket_id, uploader, flush_interval=FLUSH_INTERVAL):
+        self.bucket_id = bucket_id
+        self.uploader = uploader
+        self.flush_interval = flush_interval
+        # Delivery callbacks arrive on the upload thread (or inline when the queue is full)
+        self.lock = threading.RLock()
+        self.run = 0
+        self.data = None
+        self.run_start = None
+        self.run_end = None
+        self.pulsetime = 0
+        self.last_flush = None
+        self.pending = False
+        self.opened = None  # Opening heartbeat delivered: True / False, None while queued
+
+    def heartbeat(self, data, pulsetime, timestamp=None):
+        """Record a heartbeat, sending it only if the server needs to hear about it now"""
+        timestamp = timestamp or datetime.now(timezone.utc)
+        with self.lock:
+            if self.data == data and would_merge(self.run_start, self.run_end, timestamp, pulsetime):
+                self.run_end = timestamp
+                self.pulsetime = pulsetime
+                self.pending = True
+                if (timestamp - self.last_flush).total_seconds() >= self.flush_interval:
+                    self._flush()
+                return
+
+            # Close the previous run first so the server backfills from its real end
+            self._flush()
+            self._start_run(data, timestamp, pulsetime)
+
+    def _start_run(self, data, timestamp, pulsetime):
+        """Make `data` the current run and send its opening heartbeat"""
+        # All run state changes together, so nothing of the previous run
+        # (a pending end, its data, a late delivery report) is ever applied to this one
+        self.run += 1
+        self.data = data
+        self.run_start = self.run_end = self.last_flush = timestamp
+        self.pulsetime = pulsetime
+        self.pending = False
+        self._send_opening()
+
+    def flush(self):
+        """Send the pending end of the current run, if any"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.data is None:
+            return
+        if self.opened is False:
+            self._send_opening()
+        if not self.pending:
+            return
+        pulsetime = max(self.pulsetime, (self.run_end - self.run_start).total_seconds())
+        run, end = self.run, self.run_end
+
+        def on_done(delivered):
+            with self.lock:
+                if not delivered and run == self.run:
+                    self.pending = True  # Sent again with the next flush
+
+        self.pending = False
+        self.last_flush = end
+        self._send(self.data, end, pulsetime, on_done)
+
+    def _send_opening(self):
+        run = self.run
+
+        def on_done(delivered):
+            with self.lock:
+                if run == self.run:
+                    self.opened = delivered
+
+        self.opened = None
+        self._send(self.data, self.run_start, self.pulsetime, on_done)
+
+    def _send(self, data, timestamp, pulsetime, on_done=None):
+        event = {
+            "employee_id": EMPLOYEE_ID,
+            "device_id": DEVICE_ID,
+            "data": data,
+            "duration": 0,
+            "timestamp": timestamp.isoformat()
+        }
+        self.uploader.put(self.bucket_id, event, pulsetime, on_done)
+
+
+@lru_cache(maxsize=256)
+def process_name(hwnd, pid):
+    """Executable name for a window's process, cached per (window, PID) so polls skip the lookup"""
+    if psutil is None:
+        return "Unknown"
+    try:
+        return psutil.Process(pid).name()
+    except Exception:
+        return "Unknown"
+
+
+class LASTINPUTINFO(ctypes.Structure):
+    _fields_ = [
+        ('cbSize', ctypes.c_uint),
+        ('dwTime', ctypes.c_uint),
+    ]
+
 
 class WindowWatcher:
     """Watches active window using heartbeat mechanism (like aw-watcher-window)"""
 
-    def __init__(self):
+    def __init__(self, uploader):
         self.last_window = None
         self.last_timestamp = None
+        self.merger = HeartbeatMerger(f"aw-watcher-window_{DEVICE_ID}", uploader)
+        self.poller = AdaptivePoller(WINDOW_POLL_INTERVAL, WINDOW_MAX_POLL_INTERVAL, WINDOW_POLL_INTERVAL * 2.0)
         self._init_bucket()
 
     def _init_bucket(self):
         """Initialize bucket with correct type"""
         try:
             bucket_id = f"aw-watcher-window_{DEVICE_ID}"
-            requests.post(
+            http.post(
                 f"{SERVER_URL}/api/0/buckets/{bucket_id}",
                 json={
                     "client": "aw-watcher-window",
                     "type": "currentwindow",
-                    "hostname": DEVICE_ID
+                    "hostname": DEVICE_ID,
+                    "employee_id": EMPLOYEE_ID
                 },
-                timeout=5
+                timeout=HTTP_TIMEOUT
             )
             logger.info(f"Initialized bucket: {bucket_id}")
         except Exception as e:
@@ -51,9 +268,6 @@ class WindowWatcher:
     def get_active_window(self):
         """Get currently active window info"""
         try:
-            import ctypes
-            from ctypes import wintypes
-
             user32 = ctypes.windll.user32
 
             # Get foreground window
@@ -69,12 +283,7 @@ class WindowWatcher:
             pid = wintypes.DWORD()
             user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
 
-            try:
-                import psutil
-                process = psutil.Process(pid.value)
-                app = process.name()
-            except:
-                app = "Unknown"
+            app = process_name(hwnd, pid.value)
 
             return {"app": app, "title": title}
 
@@ -82,86 +291,51 @@ class WindowWatcher:
             logger.error(f"Error getting window: {e}")
             return {"app": "Unknown", "title": "Unknown"}
 
-    def run(self):
-        """Main window watching loop - sends heartbeats every poll interval"""
-        logger.info("Window watcher started")
+    def poll(self):
+        """Scheduler probe - records a heartbeat and returns the delay until the next poll"""
+        self.poller.tick()
+        window = self.get_active_window()
+        changed = window != self.last_window
+        self.last_window = window
 
-        while True:
-            try:
-                window = self.get_active_window()
-
-                # Send heartbeat - server handles duration calculation
-                self.send_heartbeat(window)
+        # Merged locally - only changes and periodic updates reach the server
+        self.send_heartbeat(window)
 
-                time.sleep(WINDOW_POLL_INTERVAL)
-
-            except Exception as e:
-                logger.error(f"Window watcher error: {e}")
-                time.sleep(10)
+        return self.poller.next_delay(changed)
 
     def send_heartbeat(self, window_data):
-        """Send window heartbeat to server"""
-        try:
-            event = {
-                "employee_id": EMPLOYEE_ID,
-                "device_id": DEVICE_ID,
-                "data": window_data,
-                "duration": 0,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-
-            # Use heartbeat endpoint with pulsetime = poll_time * 2
-            pulsetime = WINDOW_POLL_INTERVAL * 2.0
-            response = requests.post(
-                f"{SERVER_URL}/api/0/buckets/aw-watcher-window_{DEVICE_ID}/heartbeat?pulsetime={pulsetime}",
-                json=event,
-                timeout=5
-            )
-
-            if response.status_code == 200:
-                pass  # Normal heartbeat
-            else:
-                logger.warning(f"Heartbeat failed: {response.status_code}")
-
-        except requests.exceptions.ConnectionError:
-            logger.warning("Server not available, will retry...")
-        except Exception as e:
-            logger.error(f"Error sending heartbeat: {e}")
+        """Send window heartbeat to server (pulsetime = time since last poll * 2)"""
+        self.merger.heartbeat(window_data, self.poller.pulsetime())
 
 
 class AFKWatcher:
     """Watches for AFK (away from keyboard) status"""
 
-    def __init__(self):
+    def __init__(self, uploader):
         self.last_input_time = datetime.now(timezone.utc)
         self.is_afk = False
+        self.merger = HeartbeatMerger(f"aw-watcher-afk_{DEVICE_ID}", uploader)
+        self.poller = AdaptivePoller(AFK_POLL_INTERVAL, AFK_MAX_POLL_INTERVAL, 60)
         self._init_bucket()
 
     def _init_bucket(self):
         """Initialize bucket with correct type and send initial not-afk event"""
         try:
             bucket_id = f"aw-watcher-afk_{DEVICE_ID}"
-            requests.post(
+            http.post(
                 f"{SERVER_URL}/api/0/buckets/{bucket_id}",
                 json={
                     "client": "aw-watcher-afk",
                     "type": "afkstatus",
-                    "hostname": DEVICE_ID
+                    "hostname": DEVICE_ID,
+                    "employee_id": EMPLOYEE_ID
                 },
-                timeout=5
+                timeout=HTTP_TIMEOUT
             )
             logger.info(f"Initialized bucket: {bucket_id}")
 
             # Send initial not-afk event so aw-webui has data
-            requests.post(
-                f"{SERVER_URL}/api/0/buckets/{bucket_id}/heartbeat?pulsetime=60",
-                json={
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "duration": 0,
-                    "data": {"status": "not-afk"}
-                },
-                timeout=5
-            )
+            self.send_afk_heartbeat("not-afk")
             logger.info("Sent initial not-afk event")
         except Exception as e:
             logger.warning(f"Failed to init bucket: {e}")
@@ -169,14 +343,6 @@ class AFKWatcher:
     def get_idle_time(self):
         """Get system idle time in seconds (Windows)"""
         try:
-            import ctypes
-
-            class LASTINPUTINFO(ctypes.Structure):
-                _fields_ = [
-                    ('cbSize', ctypes.c_uint),
-                    ('dwTime', ctypes.c_uint),
-                ]
-
             lii = LASTINPUTINFO()
             lii.cbSize = ctypes.sizeof(LASTINPUTINFO)
 
@@ -190,56 +356,30 @@ class AFKWatcher:
             logger.error(f"Error getting idle time: {e}")
             return 0
 
-    def run(self):
-        """Main AFK watching loop"""
-        logger.info("AFK watcher started")
-
-        while True:
-            try:
-                idle_seconds = self.get_idle_time()
-                now = datetime.now(timezone.utc)
-
-                was_afk = self.is_afk
-                self.is_afk = idle_seconds > AFK_TIMEOUT
+    def poll(self):
+        """Scheduler probe - records the AFK status and returns the delay until the next poll"""
+        self.poller.tick()
+        idle_seconds = self.get_idle_time()
 
-                # Always send heartbeat with current status
-                # This accumulates duration when status stays the same
-                status = "afk" if self.is_afk else "not-afk"
-                self.send_afk_heartbeat(status)
+        was_afk = self.is_afk
+        self.is_afk = idle_seconds > AFK_TIMEOUT
 
-                # Log status changes
-                if self.is_afk != was_afk:
-                    logger.info(f"AFK status changed: {status}")
+        # Always record a heartbeat with current status
+        # Merged locally while the status stays the same
+        status = "afk" if self.is_afk else "not-afk"
+        self.send_afk_heartbeat(status)
 
-                time.sleep(5)
+        # Log status changes
+        if self.is_afk != was_afk:
+            logger.info(f"AFK status changed: {status}")
 
-            except Exception as e:
-                logger.error(f"AFK watcher error: {e}")
-                time.sleep(10)
+        # Don't sleep past the moment the user would become AFK
+        limit = None if self.is_afk else AFK_TIMEOUT - idle_seconds
+        return self.poller.next_delay(self.is_afk != was_afk, limit)
 
     def send_afk_heartbeat(self, status):
         """Send AFK heartbeat to server - uses heartbeat endpoint for duration accumulation"""
-        try:
-            event = {
-                "employee_id": EMPLOYEE_ID,
-                "device_id": DEVICE_ID,
-                "data": {"status": status},
-                "duration": 0,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-
-            # Use heartbeat endpoint with pulsetime to accumulate duration
-            response = requests.post(
-                f"{SERVER_URL}/api/0/buckets/aw-watcher-afk_{DEVICE_ID}/heartbeat?pulsetime=60",
-                json=event,
-                timeout=5
-            )
-
-            if response.status_code == 200:
-                pass  # Normal heartbeat response, don't log every time
-
-        except Exception as e:
-            logger.error(f"Error sending AFK event: {e}")
+        self.merger.heartbeat({"status": status}, self.poller.pulsetime())
 
 
 def main():
@@ -253,7 +393,7 @@ def main():
 
     # Check server connection
     try:
-        response = requests.get(f"{SERVER_URL}/api/0/health", timeout=5)
+        response = http.get(f"{SERVER_URL}/api/0/health", timeout=HTTP_TIMEOUT)
         if response.status_code == 200:
             print("[OK] Server is running")
         else:
@@ -261,15 +401,26 @@ def main():
     except:
         print("[WARNING] Cannot connect to server - will retry")
 
-    # Start watchers in separate threads
-    window_watcher = WindowWatcher()
-    afk_watcher = AFKWatcher()
+    # All probes run on one scheduler thread; one uploader thread talks to the server
+    uploader = HeartbeatUploader()
+    uploader.start()
+    window_watcher = WindowWatcher(uploader)
+    afk_watcher = AFKWatcher(uploader)
+
+    scheduler = Scheduler()
+    scheduler.add(window_watcher.poll)
+    scheduler.add(afk_watcher.poll)
+
+    def on_foreground_change():
+        # A returning user usually switches windows, so re-check AFK status too
+        scheduler.wake(window_watcher.poll, WAKE_DEBOUNCE)
+        scheduler.wake(afk_watcher.poll, WAKE_DEBOUNCE)
 
-    window_thread = threading.Thread(target=window_watcher.run, daemon=True)
-    afk_thread = threading.Thread(target=afk_watcher.run, daemon=True)
+    if EVENT_DRIVEN and watch_foreground_changes(on_foreground_change):
+        print("[OK] Event-driven window tracking enabled")
 
-    window_thread.start()
-    afk_thread.start()
+    scheduler_thread = threading.Thread(target=scheduler.run, daemon=True)
+    scheduler_thread.start()
 
     print("\nWatchers started. Press Ctrl+C to stop.\n")
 
@@ -278,6 +429,12 @@ def main():
             time.sleep(1)
     except KeyboardInterrupt:
         print("\nStopping watchers...")
+        scheduler.stop()
+        scheduler_thread.join(5)
+        # Send the end of the current runs so no tracked time is lost
+        window_watcher.merger.flush()
+        afk_watcher.merger.flush()
+        uploader.stop()
 
 
 if __name__ == "__main__":
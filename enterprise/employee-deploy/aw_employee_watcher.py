@@ -10,6 +10,9 @@ Installation:
 4. Run: python aw_employee_watcher.py
 
 For auto-start, use the install_service.bat script.
+
+Needs aw_watcher_common.py (shared with enterprise/aw_client_watcher.py) in
+the same folder; the install scripts copy both.
 """
 
 import time
@@ -18,8 +21,22 @@ import logging
 import requests
 import ctypes
 import sys
+import json
+import gzip
+import random
+import sqlite3
 from datetime import datetime, timezone
-from threading import Thread
+from functools import lru_cache
+from threading import Thread, Lock
+
+from aw_watcher_common import make_session, would_merge, AdaptivePoller, Scheduler, watch_foreground_changes
+
+try:
+    import win32gui
+    import win32process
+    import psutil
+except ImportError:
+    win32gui = win32process = psutil = None
 
 # ============================================================
 # CONFIGURATION - EDIT THESE VALUES
@@ -35,9 +52,25 @@ CONFIG = {
     "DEPARTMENT": "Engineering",  # Department name
 
     # Polling intervals (in seconds)
-    "WINDOW_POLL_INTERVAL": 5,    # How often to check active window
-    "AFK_POLL_INTERVAL": 5,       # How often to check AFK status
+    "WINDOW_POLL_INTERVAL": 5,    # How often to check active window while it keeps changing
+    "WINDOW_MAX_POLL_INTERVAL": 30,  # Slowest window check once it stays the same
+    "AFK_POLL_INTERVAL": 5,       # How often to check AFK status right after it changed
+    "AFK_MAX_POLL_INTERVAL": 30,  # Slowest AFK check while the status stays the same
     "AFK_TIMEOUT": 180,           # Seconds of inactivity before marking as AFK
+    "EVENT_DRIVEN": True,         # Wake up on foreground window changes (Windows)
+    "WAKE_DEBOUNCE": 1.0,         # Seconds to wait after a window event, so bursts become one poll
+
+    # Offline spool and batched upload
+    "SPOOL_FILE": "aw_watcher_spool.db",  # Local queue of heartbeats not yet uploaded
+    "UPLOAD_INTERVAL": 30,        # Seconds between batched uploads
+    "UPLOAD_BATCH_SIZE": 500,     # Max heartbeats per upload
+    "MAX_BACKOFF": 300,           # Max seconds between retries while the server is down
+
+    # HTTP connection settings
+    "HTTP_POOL_SIZE": 2,          # Keep-alive connections kept open to the server
+    "HTTP_RETRIES": 2,            # Quick retries on connection errors and 502/503/504
+    "HTTP_CONNECT_TIMEOUT": 5,    # Seconds to wait for a connection
+    "HTTP_READ_TIMEOUT": 30,      # Seconds to wait for a response
 }
 # ============================================================
 
@@ -57,13 +90,18 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=256)
+def process_name(hwnd, pid):
+    """Executable name for a window's process, cached per (window, PID) so polls skip the lookup"""
+    try:
+        return psutil.Process(pid).name()
+    except Exception:
+        return "unknown"
+
+
 def get_active_window():
     """Get the currently active window title and application name (Windows)"""
     try:
-        import win32gui
-        import win32process
-        import psutil
-
         hwnd = win32gui.GetForegroundWindow()
         if not hwnd:
             return None, None
@@ -73,11 +111,7 @@ def get_active_window():
 
         # Get process name
         _, pid = win32process.GetWindowThreadProcessId(hwnd)
-        try:
-            process = psutil.Process(pid)
-            app = process.name()
-        except:
-            app = "unknown"
+        app = process_name(hwnd, pid)
 
         return app, title
     except Exception as e:
@@ -85,12 +119,13 @@ def get_active_window():
         return None, None
 
 
+class LASTINPUTINFO(ctypes.Structure):
+    _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
+
+
 def get_idle_time():
     """Get system idle time in seconds (Windows)"""
     try:
-        class LASTINPUTINFO(ctypes.Structure):
-            _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
-
         lii = LASTINPUTINFO()
         lii.cbSize = ctypes.sizeof(LASTINPUTINFO)
         ctypes.windll.user32.GetLastInputInfo(ctypes.byref(lii))
@@ -101,6 +136,96 @@ def get_idle_time():
         return 0
 
 
+class HeartbeatSpool:
+    """
+    Durable local queue (SQLite) of heartbeats waiting to be uploaded.
+
+    Heartbeats are pre-merged with the server's pulsetime rules. While the
+    data stays the same, a run of heartbeats is stored as its first
+    heartbeat plus one closing heartbeat that is moved forward in place.
+    The closing heartbeat's pulsetime reaches back to the start of the run,
+    so the server builds the same event it would have from every heartbeat.
+    """
+
+    def __init__(self, path):
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS heartbeats ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " bucket_id TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " inflight INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Rows claimed by an upload that never finished get sent again
+        self._conn.execute("UPDATE heartbeats SET inflight = 0")
+        self._conn.commit()
+        self._runs = {}  # bucket_id -> current run of identical heartbeats
+
+    def push(self, bucket_id, event, pulsetime):
+        """Queue a heartbeat, folding it into the bucket's current run when the server would merge it"""
+        timestamp = datetime.fromisoformat(event["timestamp"])
+        with self._lock:
+            run = self._runs.get(bucket_id)
+            if run and run["data"] == event["data"] and would_merge(run["start"], run["end"], timestamp, pulsetime):
+                run["end"] = timestamp
+                closing_pulsetime = max(pulsetime, (timestamp - run["start"]).total_seconds())
+                payload = json.dumps(dict(event, pulsetime=closing_pulsetime))
+                updated = False
+                if run["closing_id"] is not None:
+                    cur = self._conn.execute(
+                        "UPDATE heartbeats SET payload = ? WHERE id = ? AND inflight = 0",
+                        (payload, run["closing_id"])
+                    )
+                    updated = cur.rowcount > 0
+                if not updated:
+                    # Closing heartbeat already uploaded (or being uploaded) - queue a new one
+                    run["closing_id"] = self._insert(bucket_id, payload)
+            else:
+                self._insert(bucket_id, json.dumps(dict(event, pulsetime=pulsetime)))
+                self._runs[bucket_id] = {
+                    "data": event["data"],
+                    "start": timestamp,
+                    "end": timestamp,
+                    "closing_id": None
+                }
+            self._conn.commit()
+
+    def _insert(self, bucket_id, payload):
+        cur = self._conn.execute(
+            "INSERT INTO heartbeats (bucket_id, payload) VALUES (?, ?)",
+            (bucket_id, payload)
+        )
+        return cur.lastrowid
+
+    def claim(self, limit):
+        """Mark the oldest queued heartbeats as in flight and return (id, bucket_id, payload) rows"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, bucket_id, payload FROM heartbeats WHERE inflight = 0 ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+            self._conn.executemany("UPDATE heartbeats SET inflight = 1 WHERE id = ?", [(r[0],) for r in rows])
+            self._conn.commit()
+        return rows
+
+    def ack(self, ids):
+        """Drop heartbeats the server accepted"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM heartbeats WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def release(self, ids):
+        """Return heartbeats to the queue after a failed upload"""
+        with self._lock:
+            self._conn.executemany("UPDATE heartbeats SET inflight = 0 WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM heartbeats").fetchone()[0]
+
+
 class EmployeeWatcher:
     """Main watcher class that monitors window activity and AFK status"""
 
@@ -110,6 +235,21 @@ class EmployeeWatcher:
         self.running = False
         self.last_window = None
         self.last_afk_status = None
+        self.registered = False
+        self.http = make_session(CONFIG["HTTP_POOL_SIZE"], CONFIG["HTTP_RETRIES"])
+        self.timeout = (CONFIG["HTTP_CONNECT_TIMEOUT"], CONFIG["HTTP_READ_TIMEOUT"])
+        self.spool = HeartbeatSpool(CONFIG["SPOOL_FILE"])
+        self.buckets = {}          # bucket_id -> (type, client)
+        self.window_bucket = f"aw-watcher-window_{DEVICE_ID}"
+        self.afk_bucket = f"aw-watcher-afk_{DEVICE_ID}"
+        self.buckets[self.window_bucket] = ("currentwindow", "aw-watcher-window")
+        self.buckets[self.afk_bucket] = ("afkstatus", "aw-watcher-afk")
+        self.scheduler = Scheduler()
+        self.window_poller = AdaptivePoller(
+            CONFIG["WINDOW_POLL_INTERVAL"], CONFIG["WINDOW_MAX_POLL_INTERVAL"], CONFIG["WINDOW_POLL_INTERVAL"] * 2.0
+        )
+        self.afk_poller = AdaptivePoller(CONFIG["AFK_POLL_INTERVAL"], CONFIG["AFK_MAX_POLL_INTERVAL"], 60)
+        self.ready_buckets = set() # buckets known to exist on the server
 
     def register_employee(self):
         """Register this employee and device with the server"""
@@ -122,10 +262,10 @@ class EmployeeWatcher:
                 "department": CONFIG["DEPARTMENT"],
                 "role": "employee"
             }
-            r = requests.post(
+            r = self.http.post(
                 f"{self.server_url}/api/0/admin/employees",
                 json=employee_data,
-                timeout=10
+                timeout=self.timeout
             )
             if r.status_code in [200, 201]:
                 logger.info(f"Employee registered: {CONFIG['EMPLOYEE_ID']}")
@@ -140,14 +280,15 @@ class EmployeeWatcher:
                 "device_type": "desktop",
                 "os_info": f"Windows {sys.getwindowsversion().major}"
             }
-            r = requests.post(
+            r = self.http.post(
                 f"{self.server_url}/api/0/admin/devices",
                 json=device_data,
-                timeout=10
+                timeout=self.timeout
             )
             if r.status_code in [200, 201]:
                 logger.info(f"Device registered: {DEVICE_ID}")
 
+            self.registered = True
         except Exception as e:
             logger.error(f"Error registering employee/device: {e}")
 
@@ -159,12 +300,13 @@ class EmployeeWatcher:
                 "name": bucket_id,
                 "type": bucket_type,
                 "client": client,
-                "hostname": HOSTNAME
+                "hostname": HOSTNAME,
+                "employee_id": self.employee_id
             }
-            r = requests.post(
+            r = self.http.post(
                 f"{self.server_url}/api/0/buckets/{bucket_id}",
                 json=bucket_data,
-                timeout=10
+                timeout=self.timeout
             )
             if r.status_code in [200, 304]:
                 logger.info(f"Bucket ready: {bucket_id}")
@@ -174,7 +316,7 @@ class EmployeeWatcher:
         return False
 
     def send_heartbeat(self, bucket_id, data, pulsetime=60):
-        """Send a heartbeat event to the server"""
+        """Queue a heartbeat event in the spool; upload_loop() sends it to the server"""
         try:
             event = {
                 "timestamp": datetime.now(timezone.utc).isoformat(),
@@ -183,65 +325,122 @@ class EmployeeWatcher:
                 "employee_id": self.employee_id,
                 "device_id": DEVICE_ID
             }
-            r = requests.post(
-                f"{self.server_url}/api/0/buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}",
-                json=event,
-                timeout=5
+            self.spool.push(bucket_id, event, pulsetime)
+            return True
+        except Exception as e:
+            logger.error(f"Error spooling heartbeat: {e}")
+            return False
+
+    def upload_loop(self):
+        """Upload the spool in batches, backing off with jitter while the server is unreachable"""
+        failures = 0
+        # Spread uploads across the fleet instead of every machine posting at once
+        time.sleep(random.uniform(0, CONFIG["UPLOAD_INTERVAL"]))
+
+        while self.running:
+            if self.upload_pending():
+                if failures:
+                    logger.info("Server reachable again - spool uploaded")
+                failures = 0
+                delay = CONFIG["UPLOAD_INTERVAL"]
+            else:
+                failures += 1
+                backoff = min(CONFIG["MAX_BACKOFF"], CONFIG["UPLOAD_INTERVAL"] * 2 ** failures)
+                delay = random.uniform(CONFIG["UPLOAD_INTERVAL"], max(CONFIG["UPLOAD_INTERVAL"], backoff))
+                logger.warning(f"Upload failed, {self.spool.size()} heartbeats spooled - retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+    def upload_pending(self):
+        """Upload everything in the spool. Returns False if the server could not be reached."""
+        if not self.registered:
+            self.register_employee()
+
+        while True:
+            rows = self.spool.claim(CONFIG["UPLOAD_BATCH_SIZE"])
+            if not rows:
+                return True
+
+            # One request per bucket, heartbeats kept in spool order
+            by_bucket = {}
+            for row_id, bucket_id, payload in rows:
+                by_bucket.setdefault(bucket_id, []).append((row_id, payload))
+
+            pending_ids = {row[0] for row in rows}
+            for bucket_id, items in by_bucket.items():
+                ids = [row_id for row_id, _ in items]
+                if not self.ensure_bucket(bucket_id) or \
+                        not self.post_heartbeats(bucket_id, [payload for _, payload in items]):
+                    self.spool.release(list(pending_ids))
+                    return False
+                self.spool.ack(ids)
+                pending_ids.difference_update(ids)
+
+    def ensure_bucket(self, bucket_id):
+        """Create a bucket on the server the first time we upload to it"""
+        if bucket_id in self.ready_buckets:
+            return True
+        bucket_type, client = self.buckets.get(bucket_id, ("unknown", "unknown"))
+        if self.create_bucket(bucket_id, bucket_type, client):
+            self.ready_buckets.add(bucket_id)
+            return True
+        return False
+
+    def post_heartbeats(self, bucket_id, payloads):
+        """Send a gzip-compressed batch of heartbeats for one bucket"""
+        body = gzip.compress(("[" + ",".join(payloads) + "]").encode("utf-8"))
+        try:
+            r = self.http.post(
+                f"{self.server_url}/api/0/buckets/{bucket_id}/heartbeat",
+                data=body,
+                headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+                timeout=self.timeout
             )
+            if r.status_code != 200:
+                logger.warning(f"Heartbeat upload for {bucket_id} returned {r.status_code}")
             return r.status_code == 200
         except requests.exceptions.ConnectionError:
-            logger.warning("Cannot connect to server - will retry")
             return False
         except Exception as e:
-            logger.error(f"Error sending heartbeat: {e}")
+            logger.error(f"Error uploading heartbeats: {e}")
             return False
 
-    def watch_windows(self):
-        """Monitor active window and send heartbeats"""
-        bucket_id = f"aw-watcher-window_{DEVICE_ID}"
-        self.create_bucket(bucket_id, "currentwindow", "aw-watcher-window")
-
-        poll_interval = CONFIG["WINDOW_POLL_INTERVAL"]
-        pulsetime = poll_interval * 2.0
-
-        while self.running:
-            try:
-                app, title = get_active_window()
-                if app and title:
-                    window_data = {"app": app, "title": title}
-                    if window_data != self.last_window:
-                        logger.debug(f"Window changed: {app} - {title[:50]}")
-                    self.send_heartbeat(bucket_id, window_data, pulsetime)
-                    self.last_window = window_data
-            except Exception as e:
-                logger.error(f"Window watcher error: {e}")
-
-            time.sleep(poll_interval)
-
-    def watch_afk(self):
-        """Monitor AFK status and send heartbeats"""
-        bucket_id = f"aw-watcher-afk_{DEVICE_ID}"
-        self.create_bucket(bucket_id, "afkstatus", "aw-watcher-afk")
-
-        poll_interval = CONFIG["AFK_POLL_INTERVAL"]
+    def poll_window(self):
+        """Scheduler probe - record the active window, return the delay until the next poll"""
+        poller = self.window_poller
+        poller.tick()
+
+        changed = False
+        app, title = get_active_window()
+        if app and title:
+            window_data = {"app": app, "title": title}
+            changed = window_data != self.last_window
+            if changed:
+                logger.debug(f"Window changed: {app} - {title[:50]}")
+            self.send_heartbeat(self.window_bucket, window_data, poller.pulsetime())
+            self.last_window = window_data
+
+        return poller.next_delay(changed)
+
+    def poll_afk(self):
+        """Scheduler probe - record AFK status, return the delay until the next poll"""
+        poller = self.afk_poller
+        poller.tick()
         afk_timeout = CONFIG["AFK_TIMEOUT"]
 
-        while self.running:
-            try:
-                idle_time = get_idle_time()
-                is_afk = idle_time >= afk_timeout
-                status = "afk" if is_afk else "not-afk"
-
-                if status != self.last_afk_status:
-                    logger.info(f"AFK status changed: {status}")
-                    self.last_afk_status = status
+        idle_time = get_idle_time()
+        is_afk = idle_time >= afk_timeout
+        status = "afk" if is_afk else "not-afk"
 
-                self.send_heartbeat(bucket_id, {"status": status}, pulsetime=60)
+        changed = status != self.last_afk_status
+        if changed:
+            logger.info(f"AFK status changed: {status}")
+            self.last_afk_status = status
 
-            except Exception as e:
-                logger.error(f"AFK watcher error: {e}")
+        self.send_heartbeat(self.afk_bucket, {"status": status}, pulsetime=poller.pulsetime())
 
-            time.sleep(poll_interval)
+        # Don't sleep past the moment the user would become AFK
+        limit = None if is_afk else afk_timeout - idle_time
+        return poller.next_delay(changed, limit)
 
     def start(self):
         """Start the watcher"""
@@ -253,30 +452,34 @@ class EmployeeWatcher:
         logger.info(f"Device: {DEVICE_ID}")
         logger.info("=" * 60)
 
-        # Test server connection
+        # Test server connection - if it is down, heartbeats are spooled until it is back
         try:
-            r = requests.get(f"{self.server_url}/api/0/info", timeout=5)
+            r = self.http.get(f"{self.server_url}/api/0/info", timeout=self.timeout)
             if r.status_code == 200:
                 logger.info("Connected to server successfully")
+                # Register employee and device
+                self.register_employee()
             else:
-                logger.error(f"Server returned: {r.status_code}")
-                return
+                logger.warning(f"Server returned: {r.status_code} - spooling heartbeats offline")
         except Exception as e:
-            logger.error(f"Cannot connect to server: {e}")
-            logger.error("Please check SERVER_URL in configuration")
-            return
-
-        # Register employee and device
-        self.register_employee()
+            logger.warning(f"Cannot connect to server: {e} - spooling heartbeats offline")
+            logger.warning("Please check SERVER_URL in configuration if this persists")
 
         # Start watchers
         self.running = True
 
-        window_thread = Thread(target=self.watch_windows, daemon=True)
-        afk_thread = Thread(target=self.watch_afk, daemon=True)
+        # Foreground switches wake both watchers; a returning user usually switches windows
+        if CONFIG["EVENT_DRIVEN"] and watch_foreground_changes(self.on_foreground_change):
+            logger.info("Event-driven window tracking enabled")
 
-        window_thread.start()
-        afk_thread.start()
+        # All probes share one scheduler thread; the spool is uploaded from another
+        self.scheduler.add(self.poll_window)
+        self.scheduler.add(self.poll_afk)
+        scheduler_thread = Thread(target=self.scheduler.run, daemon=True)
+        upload_thread = Thread(target=self.upload_loop, daemon=True)
+
+        scheduler_thread.start()
+        upload_thread.start()
 
         logger.info("Watchers started - Press Ctrl+C to stop")
 
@@ -285,13 +488,19 @@ class EmployeeWatcher:
                 time.sleep(1)
         except KeyboardInterrupt:
             logger.info("Stopping watchers...")
-            self.running = False
+            self.stop()
 
         logger.info("Watcher stopped")
 
+    def on_foreground_change(self):
+        """Called from the window event hook thread"""
+        self.scheduler.wake(self.poll_window, CONFIG["WAKE_DEBOUNCE"])
+        self.scheduler.wake(self.poll_afk, CONFIG["WAKE_DEBOUNCE"])
+
     def stop(self):
         """Stop the watcher"""
         self.running = False
+        self.scheduler.stop()
 
 
 if __name__ == "__main__":
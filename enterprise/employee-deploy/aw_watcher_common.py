@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the ActivityWatch watchers: aw_employee_watcher.py next to
+this file, and enterprise/aw_client_watcher.py, which imports it from here.
+
+It lives in employee-deploy/ so the deploy folder stays self-contained: the
+install scripts copy it next to aw_employee_watcher.py.
+"""
+
+import sys
+import time
+import heapq
+import ctypes
+import logging
+import itertools
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from ctypes import wintypes
+except (ImportError, ValueError):
+    wintypes = None
+
+logger = logging.getLogger(__name__)
+
+
+def make_session(pool_size, retries):
+    """Create a requests session that keeps connections to the server alive"""
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=None  # heartbeats are POSTs; the server drops duplicates
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def would_merge(run_start, run_end, timestamp, pulsetime):
+    """
+    The server's heartbeat() merge rule for a heartbeat with the same data:
+    within pulsetime of the last event's end, or of its start while it
+    still has zero duration.
+    """
+    since_end = (timestamp - run_end).total_seconds()
+    since_start = (timestamp - run_start).total_seconds()
+    return 0 <= since_end <= pulsetime or (run_end == run_start and 0 <= since_start <= pulsetime)
+
+
+class AdaptivePoller:
+    """
+    Poll interval for one watcher probe.
+
+    Stays at min_interval while the watched state keeps changing and doubles,
+    up to max_interval, for every poll that sees no change.
+    """
+
+    def __init__(self, min_interval, max_interval, base_pulsetime):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.base_pulsetime = base_pulsetime
+        self.interval = min_interval
+        self.waited = min_interval
+        self.last_poll = time.monotonic()
+
+    def tick(self):
+        """Call at the start of every poll"""
+        now = time.monotonic()
+        self.waited = now - self.last_poll
+        self.last_poll = now
+
+    def pulsetime(self):
+        """Pulsetime for the heartbeat of the current poll: twice the time since the previous poll"""
+        return max(self.base_pulsetime, 2.0 * self.waited)
+
+    def next_delay(self, changed, limit=None):
+        """Seconds until the next poll. `limit` caps the wait, e.g. until the user would become AFK."""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+        return self.interval if limit is None else max(0.5, min(self.interval, limit))
+
+
+class Scheduler:
+    """
+    Runs every watcher probe on one thread from a single timer heap.
+
+    A probe is a callable returning the seconds until it should run again.
+    wake() pulls a probe forward, e.g. from a window event hook.
+    """
+
+    def __init__(self):
+        self._heap = []   # (due, seq, probe); entries whose due no longer matches _due are stale
+        self._due = {}    # probe -> due time of its live entry
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.running = False
+
+    def add(self, probe, delay=0):
+        with self._cond:
+            self._schedule(probe, delay)
+
+    def wake(self, probe, delay=0):
+        """Run `probe` within `delay` seconds unless it is already due sooner (or running)"""
+        with self._cond:
+            due = self._due.get(probe)
+            if due is not None and due > time.monotonic() + delay:
+                self._schedule(probe, delay)
+
+    def _schedule(self, probe, delay):
+        due = time.monotonic() + delay
+        self._due[probe] = due
+        heapq.heappush(self._heap, (due, next(self._seq), probe))
+        self._cond.notify()
+
+    def _next_probe(self):
+        """Block until a probe is due; returns None once stopped"""
+        with self._cond:
+            while self.running:
+                while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, probe = self._heap[0]
+                wait = due - time.monotonic()
+                if wait <= 0:
+                    heapq.heappop(self._heap)
+                    del self._due[probe]
+                    return probe
+                self._cond.wait(wait)
+        return None
+
+    def run(self):
+        """Run probes until stop() is called"""
+        self.running = True
+        while True:
+            probe = self._next_probe()
+            if probe is None:
+                return
+            try:
+                delay = probe()
+            except Exception as e:
+                logger.error(f"Watcher error in {probe.__qualname__}: {e}")
+                delay = 10
+            self.add(probe, delay)
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
+
+
+# Windows event hook constants
+EVENT_SYSTEM_FOREGROUND = 0x0003
+EVENT_OBJECT_NAMECHANGE = 0x800C
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+OBJID_WINDOW = 0
+
+
+def watch_foreground_changes(callback):
+    """
+    Call `callback` whenever the foreground window changes or renames itself.
+
+    Uses SetWinEventHook on Windows, pumping messages in a daemon thread.
+    Returns False when the OS offers no such notification.
+    """
+    if sys.platform != "win32" or wintypes is None:
+        return False
+
+    installed = threading.Event()
+    result = {"ok": False}
+
+    def pump():
+        user32 = ctypes.windll.user32
+        user32.SetWinEventHook.restype = wintypes.HANDLE
+        WinEventProc = ctypes.WINFUNCTYPE(
+            None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+            wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD
+        )
+
+        def on_event(hook, event, hwnd, id_object, id_child, thread_id, event_time):
+            if event == EVENT_SYSTEM_FOREGROUND or \
+                    (id_object == OBJID_WINDOW and hwnd == user32.GetForegroundWindow()):
+                callback()
+
+        proc = WinEventProc(on_event)
+        flags = WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+        hooks = [
+            user32.SetWinEventHook(EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND, 0, proc, 0, 0, flags),
+            user32.SetWinEventHook(EVENT_OBJECT_NAMECHANGE, EVENT_OBJECT_NAMECHANGE, 0, proc, 0, 0, flags),
+        ]
+        result["ok"] = all(hooks)
+        installed.set()
+        if not result["ok"]:
+            return
+
+        msg = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(msg))
+            user32.DispatchMessageW(ctypes.byref(msg))
+
+    threading.Thread(target=pump, daemon=True).start()
+    installed.wait(5)
+    return result["ok"]
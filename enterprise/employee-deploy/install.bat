@@ -48,6 +48,7 @@ if not exist "%INSTALL_DIR%" mkdir "%INSTALL_DIR%"
 :: Copy watcher script
 echo Copying watcher script...
 copy /Y "aw_employee_watcher.py" "%INSTALL_DIR%\" >nul
+copy /Y "aw_watcher_common.py" "%INSTALL_DIR%\" >nul
 copy /Y "config.txt" "%INSTALL_DIR%\" >nul 2>&1
 echo [OK] Files copied
 echo.
@@ -25,6 +25,7 @@ if not exist "%INSTALL_DIR%" mkdir "%INSTALL_DIR%"
 
 :: Copy and configure watcher
 copy /Y "%~dp0aw_employee_watcher.py" "%INSTALL_DIR%\" >nul
+copy /Y "%~dp0aw_watcher_common.py" "%INSTALL_DIR%\" >nul
 
 :: Update configuration
 powershell -Command "(Get-Content '%INSTALL_DIR%\aw_employee_watcher.py') -replace '\"SERVER_URL\": \"http://[^\"]+\"', '\"SERVER_URL\": \"http://%SERVER_IP%:5601\"' | Set-Content '%INSTALL_DIR%\aw_employee_watcher.py'"
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Heartbeat load test for the enterprise server.
+
+Simulates a fleet of employee watchers, each sending window and AFK
+heartbeats with the same payloads as employee-deploy/aw_employee_watcher.py,
+and reports throughput, latency percentiles, DB rows written and the
+heartbeat merge ratio (read from the server's /metrics before and after).
+
+Heartbeat timestamps follow a simulated clock: every simulated poll moves it
+forward by --poll-interval seconds, and --speedup compresses wall time, so
+a short run covers a long stretch of simulated activity.
+
+Usage:
+    python loadtest.py --employees 50 --duration 60
+    python loadtest.py --server http://10.0.0.5:5601 --employees 500 --speedup 20
+"""
+
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+SERVER = "http://localhost:5601"
+
+APPS = [
+    ("chrome.exe", ["Inbox - Mail", "Pull request #42", "Dashboard", "Docs - Design review"]),
+    ("code.exe", ["mysql_server.py - activitywatch", "README.md - activitywatch"]),
+    ("slack.exe", ["#general", "#engineering", "Direct message"]),
+    ("excel.exe", ["Q3 budget.xlsx", "Headcount.xlsx"]),
+    ("outlook.exe", ["Calendar", "Inbox"]),
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def scrape_metrics(server):
+    """Parse the /metrics sample lines into {name{labels}: value}"""
+    try:
+        r = requests.get(f"{server}/metrics", timeout=10)
+        r.raise_for_status()
+    except Exception as e:
+        print(f"[WARNING] Could not read {server}/metrics: {e}")
+        return {}
+
+    samples = {}
+    for line in r.text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name, _, value = line.rpartition(' ')
+        try:
+            samples[name] = float(value)
+        except ValueError:
+            pass
+    return samples
+
+
+class SimulatedEmployee:
+    """One employee machine: a window and an AFK heartbeat stream"""
+
+    def __init__(self, index, args, clock_start):
+        self.args = args
+        self.employee_id = f"loadtest-emp{index:04d}"
+        self.device_id = f"loadtest-host{index:04d}"
+        self.window_bucket = f"aw-watcher-window_{self.device_id}"
+        self.afk_bucket = f"aw-watcher-afk_{self.device_id}"
+        self.session = requests.Session()
+        self.random = random.Random(args.seed + index)
+        self.clock = clock_start
+        self.window = self._pick_window()
+        self.afk = False
+        self.latencies = []
+        self.errors = 0
+
+    def _pick_window(self):
+        app, titles = self.random.choice(APPS)
+        return {"app": app, "title": self.random.choice(titles)}
+
+    def create_buckets(self):
+        for bucket_id, bucket_type, client in (
+            (self.window_bucket, "currentwindow", "aw-watcher-window"),
+            (self.afk_bucket, "afkstatus", "aw-watcher-afk"),
+        ):
+            self.session.post(
+                f"{self.args.server}/api/0/buckets/{bucket_id}",
+                json={
+                    "id": bucket_id,
+                    "name": bucket_id,
+                    "type": bucket_type,
+                    "client": client,
+                    "hostname": self.device_id,
+                    "employee_id": self.employee_id
+                },
+                timeout=10
+            )
+
+    def delete_buckets(self):
+        for bucket_id in (self.window_bucket, self.afk_bucket):
+            self.session.delete(f"{self.args.server}/api/0/buckets/{bucket_id}", timeout=60)
+
+    def send_heartbeat(self, bucket_id, data, pulsetime):
+        event = {
+            "timestamp": self.clock.isoformat(),
+            "duration": 0,
+            "data": data,
+            "employee_id": self.employee_id,
+            "device_id": self.device_id
+        }
+        started = time.perf_counter()
+        try:
+            r = self.session.post(
+                f"{self.args.server}/api/0/buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}",
+                json=event,
+                timeout=30
+            )
+            if r.status_code != 200:
+                self.errors += 1
+        except requests.RequestException:
+            self.errors += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    def run(self, stop_at):
+        poll_wall = self.args.poll_interval / self.args.speedup
+        # Spread the fleet out like real machines that started at different times
+        time.sleep(self.random.uniform(0, poll_wall))
+
+        while time.time() < stop_at:
+            if self.random.random() < self.args.afk_probability:
+                self.afk = not self.afk
+            if not self.afk and self.random.random() < self.args.switch_probability:
+                self.window = self._pick_window()
+
+            if not self.afk:
+                self.send_heartbeat(self.window_bucket, self.window, self.args.poll_interval * 2.0)
+            self.send_heartbeat(self.afk_bucket, {"status": "afk" if self.afk else "not-afk"}, 60)
+
+            self.clock += timedelta(seconds=self.args.poll_interval)
+            time.sleep(poll_wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of watchers against the server")
+    parser.add_argument("--server", default=SERVER)
+    parser.add_argument("--employees", type=int, default=20, help="simulated employee machines")
+    parser.add_argument("--duration", type=float, default=30, help="wall-clock seconds to run")
+    parser.add_argument("--poll-interval", type=float, default=5, help="simulated seconds between polls")
+    parser.add_argument("--speedup", type=float, default=10, help="simulated seconds per wall-clock second")
+    parser.add_argument("--switch-probability", type=float, default=0.05, help="chance of a window change per poll")
+    parser.add_argument("--afk-probability", type=float, default=0.01, help="chance of an AFK toggle per poll")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep the load test buckets afterwards")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  HEARTBEAT LOAD TEST")
+    print("=" * 60)
+    print(f"Server: {args.server}")
+    print(f"Employees: {args.employees}, duration: {args.duration}s, speedup: {args.speedup}x")
+
+    # Simulated clocks start far enough back that a fast run never reaches the present
+    clock_start = datetime.now(timezone.utc) - timedelta(seconds=args.duration * args.speedup * 2)
+    employees = [SimulatedEmployee(i, args, clock_start) for i in range(args.employees)]
+    for employee in employees:
+        employee.create_buckets()
+
+    before = scrape_metrics(args.server)
+    stop_at = time.time() + args.duration
+    threads = [threading.Thread(target=e.run, args=(stop_at,), daemon=True) for e in employees]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    after = scrape_metrics(args.server)
+
+    latencies = [latency for e in employees for latency in e.latencies]
+    errors = sum(e.errors for e in employees)
+
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    merges = delta('aw_heartbeats_total{outcome="merge"}')
+    inserts = delta('aw_heartbeats_total{outcome="insert"}')
+    duplicates = delta('aw_heartbeats_total{outcome="duplicate"}')
+    heartbeats = merges + inserts + duplicates
+
+    print("\n" + "=" * 60)
+    print("  RESULTS")
+    print("=" * 60)
+    print(f"  Requests:        {len(latencies)} ({errors} errors)")
+    print(f"  Throughput:      {len(latencies) / elapsed:.1f} req/s")
+    print(f"  Latency p50:     {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"  Latency p99:     {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"  Latency max:     {max(latencies, default=0) * 1000:.1f} ms")
+    if after:
+        print(f"  DB rows written: {delta('aw_db_rows_written_total'):.0f}"
+              f" ({delta('aw_db_rows_written_total') / max(len(latencies), 1):.2f} per request)")
+        print(f"  DB queries:      {delta('aw_db_queries_total'):.0f}"
+              f" ({delta('aw_db_queries_total') / max(len(latencies), 1):.2f} per request)")
+        if heartbeats:
+            print(f"  Merge ratio:     {merges / heartbeats:.1%}"
+                  f" ({merges:.0f} merged, {inserts:.0f} inserted, {duplicates:.0f} duplicate)")
+    print("=" * 60)
+
+    if not args.keep:
+        for employee in employees:
+            employee.delete_buckets()
+        print("Load test buckets deleted")
+
+    return errors == 0
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Storage backend conformance tests.
+
+Runs the same heartbeat, event insert and query checks against every
+storage backend of mysql_server.py, in-process through Flask's test client.
+
+Usage:
+    python test_storage_conformance.py                  # sqlite, then mysql if reachable
+    python test_storage_conformance.py --backend sqlite
+    AW_INTERN_EVENT_DATA=1 python test_storage_conformance.py   # normalized event data
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+BACKENDS = ["sqlite", "mysql"]
+
+# Exit code of a backend run whose database could not be reached
+SKIPPED = 2
+
+BASE = datetime(2024, 1, 1, 9, 0, 0)
+HOST = f"conformance-{uuid.uuid4().hex[:8]}"
+WINDOW_BUCKET = f"aw-watcher-window_{HOST}"
+AFK_BUCKET = f"aw-watcher-afk_{HOST}"
+
+client = None
+
+
+def ts(seconds):
+    return (BASE + timedelta(seconds=seconds)).isoformat() + "Z"
+
+
+def heartbeat(bucket_id, seconds, data, pulsetime):
+    r = client.post(f"/api/0/buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}",
+                    json={"timestamp": ts(seconds), "duration": 0, "data": data})
+    return r.get_json()
+
+
+def get_events(bucket_id):
+    """Events of a bucket, oldest first"""
+    r = client.get(f"/api/0/buckets/{bucket_id}/events?limit=-1")
+    return sorted(r.get_json(), key=lambda e: e["timestamp"])
+
+
+def check(ok, message):
+    print(f"  [{'OK' if ok else 'FAIL'}] {message}")
+    return ok
+
+
+def check_heartbeat_merge():
+    """Heartbeats with equal data within pulsetime extend one event"""
+    print("\nTEST: Heartbeat merge")
+    bucket_id = f"{WINDOW_BUCKET}-merge"
+    client.post(f"/api/0/buckets/{bucket_id}", json={"type": "currentwindow", "client": "conformance", "hostname": HOST})
+
+    code = {"app": "code.exe", "title": "mysql_server.py"}
+    chrome = {"app": "chrome.exe", "title": "Docs"}
+    heartbeat(bucket_id, 0, code, 10)
+    heartbeat(bucket_id, 5, code, 10)
+    heartbeat(bucket_id, 10, code, 10)
+    heartbeat(bucket_id, 15, chrome, 10)   # data changed
+    heartbeat(bucket_id, 20, chrome, 10)
+    heartbeat(bucket_id, 120, chrome, 10)  # beyond pulsetime
+
+    events = get_events(bucket_id)
+    ok = check(len(events) == 3, f"3 events stored (got {len(events)})")
+    if len(events) == 3:
+        ok &= check(events[0]["data"] == code and events[0]["duration"] == 15,
+                    f"first event covers 0-15s (got {events[0]['duration']})")
+        ok &= check(events[1]["data"] == chrome and events[1]["duration"] == 5,
+                    f"second event covers 15-20s (got {events[1]['duration']})")
+        ok &= check(events[2]["duration"] == 0, "event after a gap starts with duration 0")
+    client.delete(f"/api/0/buckets/{bucket_id}")
+    return ok
+
+
+def check_heartbeat_batch():
+    """A list of heartbeats is applied in order, same as one request each"""
+    print("\nTEST: Heartbeat batch")
+    bucket_id = f"{WINDOW_BUCKET}-batch"
+    client.post(f"/api/0/buckets/{bucket_id}", json={"type": "currentwindow", "client": "conformance", "hostname": HOST})
+
+    data = {"app": "slack.exe", "title": "general"}
+    batch = [{"timestamp": ts(s), "duration": 0, "data": data, "pulsetime": 10} for s in range(0, 60, 5)]
+    r = client.post(f"/api/0/buckets/{bucket_id}/heartbeat", json=batch)
+    ok = check(r.status_code == 200 and len(r.get_json()) == len(batch), "one result per heartbeat")
+
+    events = get_events(bucket_id)
+    ok &= check(len(events) == 1 and events[0]["duration"] == 55,
+                f"merged into one 55s event (got {[e['duration'] for e in events]})")
+    client.delete(f"/api/0/buckets/{bucket_id}")
+    return ok
+
+
+def check_event_insert_idempotent():
+    """Re-sent event batches are stored once, keeping the longer duration"""
+    print("\nTEST: Idempotent event insert")
+    bucket_id = f"{WINDOW_BUCKET}-insert"
+    client.post(f"/api/0/buckets/{bucket_id}", json={"type": "currentwindow", "client": "conformance", "hostname": HOST})
+
+    batch = [{"timestamp": ts(i * 60), "duration": 30, "data": {"app": "excel.exe", "title": str(i)}} for i in range(10)]
+    client.post(f"/api/0/buckets/{bucket_id}/events", json=batch)
+    batch[0]["duration"] = 45
+    r = client.post(f"/api/0/buckets/{bucket_id}/events", json=batch)
+    stored = r.get_json()
+    ok = check(all(e["id"] is not None for e in stored) and stored[0]["duration"] == 45,
+               "re-sent batch returns the stored events")
+
+    r = client.get(f"/api/0/buckets/{bucket_id}/events/count")
+    count = r.get_json()["count"]
+    ok &= check(count == 10, f"10 events after sending the batch twice (got {count})")
+    events = get_events(bucket_id)
+    ok &= check(events[0]["duration"] == 45, f"longer duration kept (got {events[0]['duration']})")
+    ok &= check([e["data"]["title"] for e in events] == [str(i) for i in range(10)], "events returned in timestamp order")
+    client.delete(f"/api/0/buckets/{bucket_id}")
+    return ok
+
+
+def check_query_semantics():
+    """The aw-webui Activity query gives the same answer on every backend"""
+    print("\nTEST: Activity query")
+    client.post(f"/api/0/buckets/{WINDOW_BUCKET}", json={"type": "currentwindow", "client": "conformance", "hostname": HOST})
+    client.post(f"/api/0/buckets/{AFK_BUCKET}", json={"type": "afkstatus", "client": "conformance", "hostname": HOST})
+    client.post(f"/api/0/buckets/{WINDOW_BUCKET}/events", json=[
+        {"timestamp": ts(0), "duration": 600, "data": {"app": "code.exe", "title": "a"}},
+        {"timestamp": ts(600), "duration": 600, "data": {"app": "chrome.exe", "title": "b"}},
+        {"timestamp": ts(1200), "duration": 600, "data": {"app": "code.exe", "title": "a"}},
+    ])
+    client.post(f"/api/0/buckets/{AFK_BUCKET}/events", json=[
+        {"timestamp": ts(300), "duration": 900, "data": {"status": "not-afk"}},
+        {"timestamp": ts(1200), "duration": 600, "data": {"status": "afk"}},
+    ])
+
+    query_lines = [
+        f'events = flood(query_bucket(find_bucket("aw-watcher-window_", "{HOST}")));',
+        f'not_afk = flood(query_bucket(find_bucket("aw-watcher-afk_", "{HOST}")));',
+        'not_afk = filter_keyvals(not_afk, "status", ["not-afk"]);',
+        'events = filter_period_intersect(events, not_afk);',
+        'title_events = sort_by_duration(merge_events_by_keys(events, ["app", "title"]));',
+        'app_events = sort_by_duration(merge_events_by_keys(title_events, ["app"]));',
+        'duration = sum_durations(events);',
+        'RETURN = {"window": {"app_events": app_events, "title_events": title_events, "duration": duration}};'
+    ]
+    timeperiod = f"{ts(-3600)}/{ts(86400)}"
+    r = client.post("/api/0/query/", json={"timeperiods": [timeperiod], "query": query_lines})
+    window = r.get_json()[0]["window"]
+
+    apps = [(e["data"]["app"], e["duration"]) for e in window["app_events"]]
+    ok = check(apps == [("chrome.exe", 600), ("code.exe", 300)], f"active time per app (got {apps})")
+    ok &= check(window["duration"] == 900, f"total active time 900s (got {window['duration']})")
+
+    for bucket_id in (WINDOW_BUCKET, AFK_BUCKET):
+        client.delete(f"/api/0/buckets/{bucket_id}")
+    return ok
+
+
+def check_hot_key_trailing_spaces():
+    """Values differing only in trailing spaces stay apart in SQL filters and merges"""
+    print("\nTEST: Trailing spaces in event data")
+    client.post(f"/api/0/buckets/{WINDOW_BUCKET}", json={"type": "currentwindow", "client": "conformance", "hostname": HOST})
+    client.post(f"/api/0/buckets/{WINDOW_BUCKET}/events", json=[
+        {"timestamp": ts(0), "duration": 10, "data": {"app": "code.exe", "title": "foo"}},
+        {"timestamp": ts(10), "duration": 20, "data": {"app": "code.exe", "title": "foo "}},
+        {"timestamp": ts(30), "duration": 40, "data": {"app": "code.exe", "title": "foo"}},
+    ])
+
+    query_lines = [
+        f'events = query_bucket(find_bucket("aw-watcher-window_", "{HOST}"));',
+        'foo = filter_keyvals(events, "title", ["foo"]);',
+        'foo_space = filter_keyvals(events, "title", ["foo "]);',
+        'titles = merge_events_by_keys(events, ["title"]);',
+        'RETURN = {"foo": foo, "foo_space": foo_space, "titles": titles};'
+    ]
+    timeperiod = f"{ts(-3600)}/{ts(86400)}"
+    result = client.post("/api/0/query/", json={"timeperiods": [timeperiod], "query": query_lines}).get_json()[0]
+
+    ok = check(sorted(e["duration"] for e in result["foo"]) == [10, 40], "filter on \"foo\" skips \"foo \"")
+    ok &= check([e["duration"] for e in result["foo_space"]] == [20], "filter on \"foo \" skips \"foo\"")
+    titles = sorted((e["data"]["title"], e["duration"]) for e in result["titles"])
+    ok &= check(titles == [("foo", 50), ("foo ", 20)], f"merge keeps \"foo\" and \"foo \" apart (got {titles})")
+
+    client.delete(f"/api/0/buckets/{WINDOW_BUCKET}")
+    return ok
+
+
+def run_backend(backend):
+    """Run all tests against one backend; called in a fresh process per backend"""
+    global client
+
+    db_path = None
+    os.environ['AW_STORAGE'] = backend
+    if backend == "sqlite":
+        db_path = tempfile.mktemp(suffix=".db", prefix="aw-conformance-")
+        os.environ['AW_SQLITE_PATH'] = db_path
+    os.environ.setdefault('AW_REQUEST_LOG', os.devnull)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        import mysql_server
+    except Exception as e:
+        print(f"[SKIP] {backend}: database not available ({type(e).__name__}: {str(e).splitlines()[0]})")
+        return SKIPPED
+    client = mysql_server.app.test_client()
+
+    tests = [
+        ("Heartbeat merge", check_heartbeat_merge),
+        ("Heartbeat batch", check_heartbeat_batch),
+        ("Idempotent event insert", check_event_insert_idempotent),
+        ("Activity query", check_query_semantics),
+        ("Trailing spaces in event data", check_hot_key_trailing_spaces),
+    ]
+    results = []
+    try:
+        for name, test_func in tests:
+            try:
+                results.append((name, test_func()))
+            except Exception as e:
+                print(f"  [FAIL] Exception: {e}")
+                results.append((name, False))
+    finally:
+        if db_path:
+            for path in (db_path, db_path + "-wal", db_path + "-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    print(f"\n{backend} summary:")
+    for name, result in results:
+        print(f"  [{'PASS' if result else 'FAIL'}] {name}")
+    return 0 if all(result for _, result in results) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage backend conformance tests")
+    parser.add_argument("--backend", choices=BACKENDS, help="test one backend in this process")
+    args = parser.parse_args()
+
+    if args.backend:
+        return run_backend(args.backend)
+
+    print("=" * 60)
+    print("STORAGE BACKEND CONFORMANCE TESTS")
+    print("=" * 60)
+    outcomes = {}
+    for backend in BACKENDS:
+        print(f"\n{'-' * 60}\nBackend: {backend}\n{'-' * 60}")
+        # The server picks its backend at import time, so each one gets its own process
+        env = {k: v for k, v in os.environ.items() if k != 'AW_DATABASE_URL'}
+        code = subprocess.call([sys.executable, os.path.abspath(__file__), "--backend", backend], env=env)
+        outcomes[backend] = {0: "PASS", SKIPPED: "SKIP"}.get(code, "FAIL")
+
+    print("\n" + "=" * 60)
+    print("SUMMARY")
+    print("=" * 60)
+    for backend, outcome in outcomes.items():
+        print(f"  [{outcome}] {backend}")
+    return 1 if "FAIL" in outcomes.values() else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,92 @@
+"""
+Timestamp handling shared by the enterprise server's endpoints and query engine.
+
+Events are stored with naive UTC datetimes and sent to clients as ISO-8601
+strings ending in 'Z'. Timestamps received with an offset are converted
+to UTC, and those without one are taken as UTC.
+
+Parsing and formatting are cached: the same timestamp strings go back and
+forth between query statements (every to_dict() formats, every interval
+operator parses), and a watcher fleet sends the same timeperiods over and
+over. Interval arithmetic works on integer epoch microseconds, which is
+exact like timedelta arithmetic but cheaper than building datetimes.
+"""
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+EPOCH = datetime(1970, 1, 1)
+
+# Distinct strings / datetimes remembered by the parse and format caches
+TIMESTAMP_CACHE_SIZE = 65536
+
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def utcnow():
+    """Current time as a naive UTC datetime"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_iso(value):
+    """ISO-8601 string -> naive UTC datetime; raises ValueError if invalid"""
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def parse_timestamp(value, default=None):
+    """parse_iso() for request values: datetimes pass through, invalid values give default"""
+    if isinstance(value, datetime):
+        if value.tzinfo:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    if not isinstance(value, str) or not value:
+        return default
+    try:
+        return parse_iso(value)
+    except ValueError:
+        return default
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def format_iso(timestamp):
+    """Naive UTC datetime -> ISO-8601 string with a 'Z' suffix (None stays None)"""
+    if timestamp is None:
+        return None
+    return timestamp.isoformat() + 'Z'
+
+
+def to_epoch_us(timestamp):
+    """Naive UTC datetime -> integer microseconds since the epoch"""
+    return (timestamp - EPOCH) // _MICROSECOND
+
+
+def from_epoch_us(epoch_us):
+    """Integer microseconds since the epoch -> naive UTC datetime"""
+    return EPOCH + timedelta(microseconds=epoch_us)
+
+
+def seconds_to_us(seconds):
+    """A duration in seconds as integer microseconds"""
+    return round(seconds * 1_000_000)
+
+
+def us_to_seconds(epoch_us):
+    """Integer microseconds as seconds, equal to timedelta.total_seconds()"""
+    return epoch_us / 1_000_000
+
+
+def parse_epoch_us(value):
+    """Event timestamp (ISO string or datetime) -> epoch microseconds, None if invalid"""
+    timestamp = parse_timestamp(value)
+    return to_epoch_us(timestamp) if timestamp is not None else None
+
+
+def format_epoch_us(epoch_us):
+    """Epoch microseconds -> ISO-8601 string with a 'Z' suffix"""
+    return format_iso(from_epoch_us(epoch_us))
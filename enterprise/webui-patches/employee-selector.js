@@ -30,6 +30,26 @@
     return selectedEmployeeId || null;
   };
 
+  // Send the selected employee with aw-webui's queries and bucket/event
+  // requests so the server only returns that employee's buckets and events
+  function installEmployeeScopeHeader() {
+    const originalOpen = XMLHttpRequest.prototype.open;
+    const originalSend = XMLHttpRequest.prototype.send;
+
+    XMLHttpRequest.prototype.open = function(method, url) {
+      this._awEmployeeScoped = typeof url === 'string' &&
+        (url.indexOf('/api/0/query') !== -1 || url.indexOf('/api/0/buckets') !== -1);
+      return originalOpen.apply(this, arguments);
+    };
+
+    XMLHttpRequest.prototype.send = function() {
+      if (this._awEmployeeScoped && selectedEmployeeId) {
+        this.setRequestHeader('X-AW-Employee', selectedEmployeeId);
+      }
+      return originalSend.apply(this, arguments);
+    };
+  }
+
   // Create the employee selector dropdown (matching ActivityWatch's Bootstrap style)
   function createEmployeeSelector() {
     const container = document.createElement('div');
@@ -293,6 +313,7 @@
     console.log('Employee selector: Initialized with', emps.length, 'employees');
   }
 
-  // Run initialization
+  // Run initialization (the header hook must be in place before aw-webui's first query)
+  installEmployeeScopeHeader();
   init();
 })();